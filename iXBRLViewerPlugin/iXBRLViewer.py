@@ -28,7 +28,11 @@ import os
 import logging
 import io
 import zipfile
-from arelle.PythonUtil import attrdict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 WIDER_NARROWER_ARCROLE = 'http://www.esma.europa.eu/xbrl/esef/arcrole/wider-narrower'
 
@@ -42,6 +46,8 @@ class NamespaceMap:
     def __init__(self):
         self.nsmap = dict()
         self.prefixmap = dict()
+        self.qnameCache = dict()
+        self.prefixCounters = dict()
 
     def getPrefix(self, ns, preferredPrefix = None):
         """
@@ -57,19 +63,35 @@ class NamespaceMap:
             if preferredPrefix and preferredPrefix not in self.prefixmap:
                 prefix = preferredPrefix
             else:
+                # Resume numbering from where we left off for this base
+                # prefix, rather than re-probing from zero each time.
                 p = preferredPrefix if preferredPrefix else "ns"
-                n = 0
-                while "%s%d" % (p,n) in self.prefixmap:
+                n = self.prefixCounters.get(p, 0)
+                prefix = f"{p}{n}"
+                while prefix in self.prefixmap:
                     n += 1
+                    prefix = f"{p}{n}"
 
-                prefix = "%s%d" % (p,n)
+                self.prefixCounters[p] = n + 1
 
             self.prefixmap[prefix] = ns
             self.nsmap[ns] = prefix
         return prefix
 
     def qname(self, qname):
-        return "%s:%s" % (self.getPrefix(qname.namespaceURI, qname.prefix), qname.localName)
+        """
+        Get a prefixed name for the specified QName.
+
+        Results are cached by namespace and local name, as the same QNames
+        occur repeatedly across facts.  The QName object itself is not used as
+        the key, as transient QName objects are created for entity identifiers.
+        """
+        key = (qname.namespaceURI, qname.localName)
+        name = self.qnameCache.get(key)
+        if name is None:
+            name = f"{self.getPrefix(qname.namespaceURI, qname.prefix)}:{qname.localName}"
+            self.qnameCache[key] = name
+        return name
 
 class IXBRLViewerBuilderError(Exception):
     pass
@@ -86,15 +108,15 @@ class IXBRLViewerBuilder:
             "facts": {},
         }
         self.footnoteRelationshipSet = ModelRelationshipSet(dts, "XBRL-footnotes")
-
-    def lineWrap(self, s, n = 80):
-        return "\n".join([s[i:i+n] for i in range(0, len(s), n)])
+        self.labelRelationshipSet = None
+        self.referenceRelationshipSet = None
+        self.periodCache = dict()
 
     def dateFormat(self, d):
         """
         Strip the time component from an ISO date if it's zero
         """
-        return re.sub("T00:00:00$", "", d)
+        return d[:-9] if d.endswith("T00:00:00") else d
 
     def escapeJSONForScriptTag(self, s):
         """
@@ -108,6 +130,10 @@ class IXBRLViewerBuilder:
         string escapes.  This is only safe to do because < > and & can't occur
         outside a string in JSON.  It can't safely be used on JS.
         """
+        # Chained str.replace is used in preference to str.translate: with
+        # multi-character replacements translate takes a slow, per-character
+        # path, whereas replace is a fast search that returns the original
+        # string unchanged if there is nothing to replace.
         return s.replace("<","\\u003C").replace(">","\\u003E").replace("&","\\u0026")
 
     def makeLanguageName(self, langCode):
@@ -138,35 +164,45 @@ class IXBRLViewerBuilder:
     def addConcept(self, concept, dimensionType = None):
         if concept is None:
             return
-        labelsRelationshipSet = self.dts.relationshipSet(XbrlConst.conceptLabel)
-        labels = labelsRelationshipSet.fromModelObject(concept)
         conceptName = self.nsmap.qname(concept.qname)
-        if conceptName not in self.taxonomyData["concepts"]:
-            conceptData = {
-                "labels": {  }
-            }
-            for lr in labels:
-                l = lr.toModelObject
-                conceptData["labels"].setdefault(self.roleMap.getPrefix(l.role),{})[l.xmlLang.lower()] = l.text;
-                self.addLanguage(l.xmlLang.lower());
+        concepts = self.taxonomyData["concepts"]
+        if conceptName in concepts:
+            return
 
-            refData = []
-            for _refRel in concept.modelXbrl.relationshipSet(XbrlConst.conceptReference).fromModelObject(concept):
-                ref = []
-                for _refPart in _refRel.toModelObject.iterchildren():
-                    ref.append([_refPart.localName, _refPart.stringValue.strip()])
-                refData.append(ref)
+        # Relationship sets are looked up on first use, rather than once
+        # per concept.
+        if self.labelRelationshipSet is None:
+            self.labelRelationshipSet = self.dts.relationshipSet(XbrlConst.conceptLabel)
+            self.referenceRelationshipSet = self.dts.relationshipSet(XbrlConst.conceptReference)
+
+        labels = {}
+        for lr in self.labelRelationshipSet.fromModelObject(concept):
+            l = lr.toModelObject
+            lang = l.xmlLang.lower()
+            labels.setdefault(self.roleMap.getPrefix(l.role),{})[lang] = l.text
+            self.addLanguage(lang)
+
+        conceptData = {
+            "labels": labels
+        }
 
-            if len(refData) > 0:
-                conceptData['r'] = refData
+        refData = []
+        for _refRel in self.referenceRelationshipSet.fromModelObject(concept):
+            ref = []
+            for _refPart in _refRel.toModelObject.iterchildren():
+                ref.append([_refPart.localName, _refPart.stringValue.strip()])
+            refData.append(ref)
 
-            if dimensionType is not None:
-                conceptData["d"] = dimensionType
+        if len(refData) > 0:
+            conceptData['r'] = refData
 
-            if concept.isEnumeration:
-                conceptData["e"] = True
+        if dimensionType is not None:
+            conceptData["d"] = dimensionType
 
-            self.taxonomyData["concepts"][conceptName] = conceptData
+        if concept.isEnumeration:
+            conceptData["e"] = True
+
+        concepts[conceptName] = conceptData
 
     def treeWalk(self, rels, item, indent = 0):
         for r in rels.fromModelObject(item):
@@ -215,36 +251,66 @@ class IXBRLViewerBuilder:
 
         return errors
 
+    def periodAspect(self, ctx):
+        """
+        Get the value of the period aspect for a context, or None if it has
+        no usable period.
+
+        Results are cached per context, as contexts are typically shared by
+        many facts.
+        """
+        if ctx in self.periodCache:
+            return self.periodCache[ctx]
+        period = None
+        if ctx.isForeverPeriod:
+            period = "f"
+        elif ctx.isInstantPeriod and ctx.instantDatetime is not None:
+            period = self.dateFormat(ctx.instantDatetime.isoformat())
+        elif ctx.isStartEndPeriod and ctx.startDatetime is not None and ctx.endDatetime is not None:
+            period = "%s/%s" % (
+                self.dateFormat(ctx.startDatetime.isoformat()),
+                self.dateFormat(ctx.endDatetime.isoformat())
+            )
+        self.periodCache[ctx] = period
+        return period
+
     def addFact(self, f):
         if f.id is None:
-            f.set("id","ixv-%d" % (self.idGen))
+            f.set("id", f"ixv-{self.idGen}")
+            self.idGen += 1
 
-        self.idGen += 1
-        conceptName = self.nsmap.qname(f.qname)
-        scheme, ident = f.context.entityIdentifier
+        qname = self.nsmap.qname
+        addConcept = self.addConcept
+        ctx = f.context
+        conceptName = qname(f.qname)
+        scheme, ident = ctx.entityIdentifier
 
         aspects = {
             "c": conceptName,
-            "e": self.nsmap.qname(QName(self.nsmap.getPrefix(scheme,"e"), scheme, ident)),
-        }
-
-        factData = {
-            "a": aspects,
+            "e": qname(QName(self.nsmap.getPrefix(scheme,"e"), scheme, ident)),
         }
 
+        invalid = False
         if f.isNil:
-            factData["v"] = None
+            value = None
         elif f.concept is not None and f.concept.isEnumeration:
             qnEnums = f.xValue
             if not isinstance(qnEnums, list):
                 qnEnums = (qnEnums,)
-            factData["v"] = " ".join(self.nsmap.qname(qn) for qn in qnEnums)
+            value = " ".join(qname(qn) for qn in qnEnums)
             for qn in qnEnums:
-                self.addConcept(self.dts.qnameConcepts.get(qn))
+                addConcept(self.dts.qnameConcepts.get(qn))
         else:
-            factData["v"] = f.value 
-            if f.value == INVALIDixVALUE:
-                factData["err"] = 'INVALID_IX_VALUE'
+            value = f.value
+            invalid = value == INVALIDixVALUE
+
+        factData = {
+            "a": aspects,
+            "v": value,
+        }
+
+        if invalid:
+            factData["err"] = 'INVALID_IX_VALUE'
 
         if f.format is not None:
             factData["f"] = str(f.format)
@@ -252,7 +318,7 @@ class IXBRLViewerBuilder:
         if f.isNumeric:
             if f.unit is not None and len(f.unit.measures[0]):
                 # XXX does not support complex units
-                unit = self.nsmap.qname(f.unit.measures[0][0])
+                unit = qname(f.unit.measures[0][0])
                 aspects["u"] = unit
             else:
                 # The presence of the unit aspect is used by the viewer to
@@ -264,24 +330,18 @@ class IXBRLViewerBuilder:
             if d != float("INF") and not math.isnan(d):
                 factData["d"] = d
 
-        for d, v in f.context.qnameDims.items():
+        for d, v in ctx.qnameDims.items():
             if v.memberQname is not None:
-                aspects[self.nsmap.qname(v.dimensionQname)] = self.nsmap.qname(v.memberQname)
-                self.addConcept(v.member)
-                self.addConcept(v.dimension, dimensionType = "e")
+                aspects[qname(v.dimensionQname)] = qname(v.memberQname)
+                addConcept(v.member)
+                addConcept(v.dimension, dimensionType = "e")
             elif v.typedMember is not None:
-                aspects[self.nsmap.qname(v.dimensionQname)] = v.typedMember.text
-                self.addConcept(v.dimension, dimensionType = "t")
-
-        if f.context.isForeverPeriod:
-            aspects["p"] = "f"
-        elif f.context.isInstantPeriod and f.context.instantDatetime is not None:
-            aspects["p"] = self.dateFormat(f.context.instantDatetime.isoformat())
-        elif f.context.isStartEndPeriod and f.context.startDatetime is not None and f.context.endDatetime is not None:
-            aspects["p"] = "%s/%s" % (
-                self.dateFormat(f.context.startDatetime.isoformat()),
-                self.dateFormat(f.context.endDatetime.isoformat())
-            )
+                aspects[qname(v.dimensionQname)] = v.typedMember.text
+                addConcept(v.dimension, dimensionType = "t")
+
+        period = self.periodAspect(ctx)
+        if period is not None:
+            aspects["p"] = period
 
         frels = self.footnoteRelationshipSet.fromModelObject(f)
         if frels:
@@ -290,37 +350,60 @@ class IXBRLViewerBuilder:
                     factData.setdefault("fn", []).append(frel.toModelObject.id)
 
         self.taxonomyData["facts"][f.id] = factData
-        self.addConcept(f.concept)
+        addConcept(f.concept)
+
+    def encodeTaxonomyData(self):
+        """
+        Encode the taxonomy data as JSON that is safe for inclusion in a
+        script tag.
+
+        orjson is used if available.  Note that the two encoders are not
+        entirely equivalent: the stdlib encoder is used with allow_nan=False,
+        and raises on NaN or infinite values, whereas orjson silently encodes
+        them as null.  Callers are responsible for not including such values
+        (see the handling of inferred decimals in addFact).
+
+        Conversely, orjson rejects some data that the stdlib encoder accepts,
+        such as strings containing lone surrogates, which can occur in file
+        names and validation messages that were not valid UTF-8
+        on disk.  In that case we fall back to the stdlib encoder.
+        """
+        taxonomyDataJSON = None
+        if orjson is not None:
+            try:
+                taxonomyDataJSON = orjson.dumps(self.taxonomyData).decode("utf-8")
+            except orjson.JSONEncodeError:
+                pass
+        if taxonomyDataJSON is None:
+            taxonomyDataJSON = json.dumps(self.taxonomyData, separators=(",", ":"), ensure_ascii=True, allow_nan=False)
+        return self.escapeJSONForScriptTag(taxonomyDataJSON)
 
     def addViewerToXMLDocument(self, xmlDocument, scriptUrl):
-        taxonomyDataJSON = self.escapeJSONForScriptTag(json.dumps(self.taxonomyData, indent=1, allow_nan=False))
-
-        for child in xmlDocument.getroot():
-            if child.tag == '{http://www.w3.org/1999/xhtml}body':
-                for body_child in child:
-                    if body_child.tag == '{http://www.w3.org/1999/xhtml}script' and body_child.get('type','') == 'application/x.ixbrl-viewer+json':
-                        self.dts.error("viewer:error", "File already contains iXBRL viewer")
-                        return False
-                child.append(etree.Comment("BEGIN IXBRL VIEWER EXTENSIONS"))
-
-                # Insert <script> tags, and make sure that they are in the
-                # default namespace, so that browsers in HTML mode will find
-                # them.
-                nsmap = { None: "http://www.w3.org/1999/xhtml" }
-                e = etree.SubElement(child, "{http://www.w3.org/1999/xhtml}script", nsmap = nsmap)
-                e.set("type", "text/javascript")
-                e.set("src", scriptUrl)
-                # Don't self close
-                e.text = ''
-
-                # Putting this in the header can interfere with character set
-                # auto detection due to its length
-                e = etree.SubElement(child, "{http://www.w3.org/1999/xhtml}script", nsmap = nsmap)
-                e.set("type", "application/x.ixbrl-viewer+json")
-                e.text = taxonomyDataJSON
-                child.append(etree.Comment("END IXBRL VIEWER EXTENSIONS"))
-                return True
-        return False
+        body = xmlDocument.getroot().find('{http://www.w3.org/1999/xhtml}body')
+        if body is None:
+            return False
+        if body.find("{http://www.w3.org/1999/xhtml}script[@type='application/x.ixbrl-viewer+json']") is not None:
+            self.dts.error("viewer:error", "File already contains iXBRL viewer")
+            return False
+        body.append(etree.Comment("BEGIN IXBRL VIEWER EXTENSIONS"))
+
+        # Insert <script> tags, and make sure that they are in the
+        # default namespace, so that browsers in HTML mode will find
+        # them.
+        nsmap = { None: "http://www.w3.org/1999/xhtml" }
+        e = etree.SubElement(body, "{http://www.w3.org/1999/xhtml}script", attrib = { "type": "text/javascript", "src": scriptUrl }, nsmap = nsmap)
+        # Don't self close
+        e.text = ''
+
+        # Putting this in the header can interfere with character set
+        # auto detection due to its length
+        e = etree.SubElement(body, "{http://www.w3.org/1999/xhtml}script", attrib = { "type": "application/x.ixbrl-viewer+json" }, nsmap = nsmap)
+        # Encode only once we know the data will be used, and avoid
+        # holding a reference to the (potentially very large) string
+        # once lxml has taken its own copy.
+        e.text = self.encodeTaxonomyData()
+        body.append(etree.Comment("END IXBRL VIEWER EXTENSIONS"))
+        return True
 
     def createViewer(self, scriptUrl="js/dist/ixbrlviewer.js", showValidations = True):
         """
@@ -337,8 +420,9 @@ class IXBRLViewerBuilder:
         self.roleMap.getPrefix(XbrlConst.dimensionDefault, "d-d")
         self.roleMap.getPrefix(WIDER_NARROWER_ARCROLE, "w-n")
 
+        addFact = self.addFact
         for f in dts.facts:
-            self.addFact(f)
+            addFact(f)
 
         self.taxonomyData["prefixes"] = self.nsmap.prefixmap
         self.taxonomyData["roles"] = self.roleMap.prefixmap
@@ -395,9 +479,11 @@ class iXBRLViewer:
             with zipfile.ZipFile(outPath, "a", zipfile.ZIP_DEFLATED, True) as zout:
                 for f in self.files:
                     self.dts.info("viewer:info", "Saving in output zip %s" % f.filename)
-                    fout = attrdict(write=lambda s: zout.writestr(_outPrefix + f.filename, s))
-                    writer = XHTMLSerializer()
-                    writer.serialize(f.xmlDocument, fout)
+                    # The size isn't known up front when streaming, so ZIP64
+                    # must be forced to allow for very large documents.
+                    with zout.open(_outPrefix + f.filename, "w", force_zip64=True) as fout:
+                        writer = XHTMLSerializer()
+                        writer.serialize(f.xmlDocument, fout)
                 zout.write(os.path.join(os.path.dirname(__file__), "viewer", "dist", "ixbrlviewer.js"), _outPrefix + "ixbrlviewer.js")
         elif os.path.isdir(outPath):
             # If output is a directory, write each file in the doc set to that
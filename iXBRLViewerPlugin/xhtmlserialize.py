@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from lxml import etree
 import re
 
 class XHTMLSerializer:
@@ -37,5 +36,16 @@ class XHTMLSerializer:
                 e.text = ''
 
     def serialize(self, xmlDocument, fout):
+        """
+        Write the document (an lxml ElementTree) to the file-like object
+        fout.
+
+        The document is written directly to fout, rather than being
+        serialized to a string first, to avoid holding a second copy of a
+        potentially very large document in memory.
+        """
         self._expandEmptyTags(xmlDocument)
-        fout.write(etree.tostring(xmlDocument, method="xml", encoding="utf-8", xml_declaration=True))
+        # Write the declaration ourselves, as lxml's write() upper-cases the
+        # encoding name.
+        fout.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        xmlDocument.write(fout, method="xml", encoding="utf-8")
@@ -3,14 +3,22 @@ import sys
 import unittest
 import json
 import logging
-from io import StringIO
+import os
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
 from collections import defaultdict
 from unittest.mock import Mock, patch
 from .mock_arelle import mock_arelle
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 mock_arelle()
 
-from iXBRLViewerPlugin.iXBRLViewer import NamespaceMap, IXBRLViewerBuilder
+from iXBRLViewerPlugin.iXBRLViewer import NamespaceMap, IXBRLViewerBuilder, iXBRLViewer, iXBRLViewerFile
 
 class TestNamespaceMap(unittest.TestCase):
 
@@ -90,6 +98,33 @@ class TestNamespaceMap(unittest.TestCase):
         result_2 = ns_map.getPrefix(namespace_2)
         self.assertEqual(result_2, 'ns1')
 
+    def test_getPrefix_with_colliding_prefixes(self):
+        """
+        Tests NamespaceMap.getPrefix with several namespaces sharing a
+        preferred prefix.  Should return sequentially numbered prefixes,
+        skipping any that are already in use.
+        """
+        ns_map = NamespaceMap()
+        self.assertEqual(ns_map.getPrefix('namespace_1', 'p'), 'p')
+        self.assertEqual(ns_map.getPrefix('namespace_2', 'p1'), 'p1')
+        self.assertEqual(ns_map.getPrefix('namespace_3', 'p'), 'p0')
+        self.assertEqual(ns_map.getPrefix('namespace_4', 'p'), 'p2')
+        self.assertEqual(ns_map.getPrefix('namespace_5', 'p'), 'p3')
+        self.assertEqual(ns_map.getPrefix('namespace_3', 'p'), 'p0')
+
+    def test_qname_repeated(self):
+        """
+        Tests NamespaceMap.qname with equal QNames.  Should return the same
+        name, using the prefix allocated on first use of the namespace.
+        """
+        ns_map = NamespaceMap()
+        q1 = Mock(namespaceURI='http://example.com', prefix='ex', localName='a')
+        q2 = Mock(namespaceURI='http://example.com', prefix='other', localName='a')
+        q3 = Mock(namespaceURI='http://example.com', prefix='other', localName='b')
+        self.assertEqual(ns_map.qname(q1), 'ex:a')
+        self.assertEqual(ns_map.qname(q2), 'ex:a')
+        self.assertEqual(ns_map.qname(q3), 'ex:b')
+
 
 class TestIXBRLViewer(unittest.TestCase):
 
@@ -344,6 +379,19 @@ class TestIXBRLViewer(unittest.TestCase):
         self.builder_1.addConcept(self.cash_concept)
         self.assertTrue(self.builder_1.taxonomyData.get('concepts').get('us-gaap:Cash'))
 
+    def test_addConcept_repeated(self):
+        """
+        Adding the same concept twice should only look up its labels once.
+        """
+        relSet = Mock(fromModelObject=Mock(return_value=[]))
+        modelXbrl = Mock(relationshipSet=Mock(return_value=relSet))
+        builder = IXBRLViewerBuilder(modelXbrl)
+        builder.addConcept(self.cash_concept)
+        builder.addConcept(self.cash_concept, dimensionType = "e")
+        self.assertEqual(modelXbrl.relationshipSet.call_count, 2)
+        self.assertEqual(relSet.fromModelObject.call_count, 2)
+        self.assertNotIn("d", builder.taxonomyData["concepts"]["us-gaap:Cash"])
+
     @patch('arelle.XbrlConst.parentChild', 'http://www.xbrl.org/2003/arcrole/parent-child')
     @patch('arelle.XbrlConst.summationItem', 'http://www.xbrl.org/2003/arcrole/summation-item')
     def test_getRelationships_simple_case(self):
@@ -360,6 +408,55 @@ class TestIXBRLViewer(unittest.TestCase):
         siPrefix = roleMap.getPrefix('http://www.xbrl.org/2003/arcrole/summation-item')
         self.assertTrue(result.get(siPrefix).get(roleMap.getPrefix('ELR')).get('us-gaap:from_concept'))
 
+    def test_addFact_generated_ids(self):
+        """
+        Facts without an ID should be given sequential IDs, skipping no
+        numbers for facts that already have an ID.
+        """
+        context = Mock(
+            entityIdentifier=('scheme', 'ident'),
+            qnameDims={},
+            isForeverPeriod=True
+        )
+        facts = [
+            Mock(id=factId, qname=self.cash_concept.qname, concept=None, context=context, isNil=True, isNumeric=False, format=None)
+            for factId in (None, 'fact_id', None)
+        ]
+        builder = IXBRLViewerBuilder(self.modelXbrl_1)
+        builder.idGen = 0
+        for f in facts:
+            builder.addFact(f)
+        facts[0].set.assert_called_once_with("id", "ixv-0")
+        facts[1].set.assert_not_called()
+        facts[2].set.assert_called_once_with("id", "ixv-1")
+
+    def test_periodAspect(self):
+        isoformat = Mock(return_value='2019-01-01T00:00:00')
+        instant = Mock(isForeverPeriod=False, isInstantPeriod=True, instantDatetime=Mock(isoformat=isoformat))
+        duration = Mock(
+            isForeverPeriod=False,
+            isInstantPeriod=False,
+            isStartEndPeriod=True,
+            startDatetime=Mock(isoformat=Mock(return_value='2019-01-01T00:00:00')),
+            endDatetime=Mock(isoformat=Mock(return_value='2020-01-01T00:00:00'))
+        )
+        forever = Mock(isForeverPeriod=True)
+        missing = Mock(isForeverPeriod=False, isInstantPeriod=False, isStartEndPeriod=False)
+
+        self.assertEqual(self.builder_1.periodAspect(instant), '2019-01-01')
+        self.assertEqual(self.builder_1.periodAspect(duration), '2019-01-01/2020-01-01')
+        self.assertEqual(self.builder_1.periodAspect(forever), 'f')
+        self.assertIsNone(self.builder_1.periodAspect(missing))
+
+        # Repeated lookups for a context should be cached
+        self.assertEqual(self.builder_1.periodAspect(instant), '2019-01-01')
+        self.assertEqual(isoformat.call_count, 1)
+
+    def test_dateFormat(self):
+        self.assertEqual(self.builder_1.dateFormat('2019-01-01T00:00:00'), '2019-01-01')
+        self.assertEqual(self.builder_1.dateFormat('2019-01-01T12:00:00'), '2019-01-01T12:00:00')
+        self.assertEqual(self.builder_1.dateFormat('2019-01-01'), '2019-01-01')
+
     def test_addELR_no_definition(self):
         """
         Adding an ELR with no definition should result in no entry in the roleDefs map
@@ -452,6 +549,68 @@ class TestIXBRLViewer(unittest.TestCase):
         self.assertEqual(facts["fact_id3"]["a"]["u"], None)
 
 
+    def _embeddedViewerJSON(self):
+        builder = IXBRLViewerBuilder(self.modelXbrl_1)
+        builder.taxonomyData["facts"]["f1"] = { "v": "<b>A & B</b>", "a": { "c": "us-gaap:Cash" } }
+        xml = lxml.etree.parse(StringIO('<html xmlns="http://www.w3.org/1999/xhtml"><body></body></html>'))
+        self.assertTrue(builder.addViewerToXMLDocument(xml, 'ixbrlviewer.js'))
+        text = xml.getroot()[0][2].text
+        # XML special characters should be escaped using JSON string escapes
+        self.assertNotIn("<", text)
+        self.assertNotIn(">", text)
+        self.assertNotIn("&", text)
+        return json.loads(text)
+
+    def test_addViewerToXMLDocument_json_encoding(self):
+        """
+        The embedded JSON should be valid and safe for inclusion in a script
+        tag when encoded with the stdlib json module.
+        """
+        with patch('iXBRLViewerPlugin.iXBRLViewer.orjson', None):
+            data = self._embeddedViewerJSON()
+        self.assertEqual(data["facts"]["f1"]["v"], "<b>A & B</b>")
+
+    @unittest.skipUnless(orjson is not None, "orjson is not installed")
+    def test_addViewerToXMLDocument_json_encoding_orjson(self):
+        """
+        The embedded JSON should be the same when encoded with orjson.
+        """
+        with patch('iXBRLViewerPlugin.iXBRLViewer.orjson', orjson):
+            fastData = self._embeddedViewerJSON()
+        with patch('iXBRLViewerPlugin.iXBRLViewer.orjson', None):
+            data = self._embeddedViewerJSON()
+        self.assertEqual(fastData, data)
+
+    @unittest.skipUnless(orjson is not None, "orjson is not installed")
+    def test_addViewerToXMLDocument_json_encoding_orjson_fallback(self):
+        """
+        Data that orjson can't encode, such as file names containing lone
+        surrogates, should fall back to the stdlib encoder.
+        """
+        filename = os.fsdecode(b"report-\xe9.html")
+        builder = IXBRLViewerBuilder(self.modelXbrl_1)
+        builder.taxonomyData["docSetFiles"] = [filename]
+        xml = lxml.etree.parse(StringIO('<html xmlns="http://www.w3.org/1999/xhtml"><body></body></html>'))
+        with patch('iXBRLViewerPlugin.iXBRLViewer.orjson', orjson):
+            self.assertTrue(builder.addViewerToXMLDocument(xml, 'ixbrlviewer.js'))
+        data = json.loads(xml.getroot()[0][2].text)
+        self.assertEqual(data["docSetFiles"], [filename])
+
+    def test_addViewerToXMLDocument_existing_viewer(self):
+        """
+        Documents that already contain a viewer, or have no body, should not
+        be modified.
+        """
+        self.modelXbrl_1.error = Mock()
+        xml = lxml.etree.parse(StringIO('<html xmlns="http://www.w3.org/1999/xhtml"><body></body></html>'))
+        self.assertTrue(self.builder_1.addViewerToXMLDocument(xml, 'ixbrlviewer.js'))
+        self.assertFalse(self.builder_1.addViewerToXMLDocument(xml, 'ixbrlviewer.js'))
+        self.assertEqual(len(xml.getroot()[0]), 4)
+        self.modelXbrl_1.error.assert_called_once()
+
+        xml = lxml.etree.parse(StringIO('<html xmlns="http://www.w3.org/1999/xhtml"><head></head></html>'))
+        self.assertFalse(self.builder_1.addViewerToXMLDocument(xml, 'ixbrlviewer.js'))
+
     def test_xhtmlNamespaceHandling(self):
         # Check the prefix used for our inserted script tags
         tests = ('''
@@ -493,3 +652,37 @@ class TestIXBRLViewer(unittest.TestCase):
             self.assertEqual(body[2].attrib.get('type'), 'application/x.ixbrl-viewer+json')
             self.assertEqual(body[3].text, 'END IXBRL VIEWER EXTENSIONS')
 
+
+class TestIXBRLViewerSave(unittest.TestCase):
+
+    def test_save_zip(self):
+        """
+        Saving to a BytesIO should stream each file, and the viewer
+        javascript, into a zip.
+        """
+        html = '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>hello</p></body></html>'
+        dts = Mock()
+        iv = iXBRLViewer(dts)
+        iv.addFile(iXBRLViewerFile('report.html', lxml.etree.ElementTree(lxml.etree.fromstring(html))))
+
+        with tempfile.TemporaryDirectory() as pluginDir:
+            os.makedirs(os.path.join(pluginDir, "viewer", "dist"))
+            with open(os.path.join(pluginDir, "viewer", "dist", "ixbrlviewer.js"), "w") as fout:
+                fout.write("// viewer")
+
+            out = BytesIO()
+            zipOpen = zipfile.ZipFile.open
+            with patch('iXBRLViewerPlugin.iXBRLViewer.__file__', os.path.join(pluginDir, "iXBRLViewer.py")), \
+                    patch.object(zipfile.ZipFile, 'open', autospec=True, side_effect=zipOpen) as openSpy:
+                iv.save(out, outzipFilePrefix="viewer")
+
+        # Streamed entries must use ZIP64, as their size isn't known up front.
+        reportOpen = next(c for c in openSpy.call_args_list if c.args[1] == 'viewer/report.html')
+        self.assertEqual(reportOpen.kwargs.get('force_zip64'), True)
+        with zipfile.ZipFile(out) as zin:
+            self.assertEqual(set(zin.namelist()), {'viewer/report.html', 'viewer/ixbrlviewer.js'})
+            self.assertEqual(
+                zin.read('viewer/report.html').decode('utf-8'),
+                "<?xml version='1.0' encoding='utf-8'?>\n" + html
+            )
+            self.assertEqual(zin.read('viewer/ixbrlviewer.js').decode('utf-8'), "// viewer")
@@ -41,7 +41,7 @@ class TestXHTMLSerializer(unittest.TestCase):
 
     def test_serialize(self):
         htmlsrc = self._html("<p>hello</p>")
-        doc = lxml.etree.fromstring(htmlsrc)
+        doc = lxml.etree.parse(io.BytesIO(htmlsrc.encode('utf-8')))
         f = io.BytesIO()
 
         writer = XHTMLSerializer()
@@ -49,3 +49,14 @@ class TestXHTMLSerializer(unittest.TestCase):
 
         # XML declaration should be added.
         self.assertEqual(f.getvalue().decode('utf-8'), "<?xml version='1.0' encoding='utf-8'?>\n" + htmlsrc)
+
+    def test_serialize_document(self):
+        htmlsrc = self._html("<p>hello</p>")
+        doc = lxml.etree.parse(io.BytesIO(('<!DOCTYPE html>\n' + htmlsrc).encode('utf-8')))
+        f = io.BytesIO()
+
+        writer = XHTMLSerializer()
+        writer.serialize(doc, f)
+
+        # Doctype should be preserved when serializing a whole document.
+        self.assertEqual(f.getvalue().decode('utf-8'), "<?xml version='1.0' encoding='utf-8'?>\n<!DOCTYPE html>\n" + htmlsrc)